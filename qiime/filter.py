@@ -47,16 +47,19 @@ def get_otu_ids_from_taxonomy_f(positive_taxa=None,
     # define a positive screening function - if the user doesn't pass
     # positive_taxa, all OTUs will pass this filter
     # (i.e., be marked for retention)
+    # the screening functions take the list of an OTU's (normalized)
+    # taxonomy levels; isdisjoint short-circuits on the first hit without
+    # building a set per OTU
     if positive_taxa is None:
         positive_taxa = set()
 
-        def positive_screen(e):
-            return True
+        def positive_screen(levels):
+            return len(levels) > 0
     else:
         positive_taxa = set([t.strip().lower() for t in positive_taxa])
 
-        def positive_screen(e):
-            return e in positive_taxa
+        def positive_screen(levels):
+            return not positive_taxa.isdisjoint(levels)
 
     # define a negative screening function - if the user doesn't pass
     # negative_taxa, all OTUs will pass this filter
@@ -64,13 +67,13 @@ def get_otu_ids_from_taxonomy_f(positive_taxa=None,
     if negative_taxa is None:
         negative_taxa = set()
 
-        def negative_screen(e):
+        def negative_screen(levels):
             return False
     else:
         negative_taxa = set([t.strip().lower() for t in negative_taxa])
 
-        def negative_screen(e):
-            return e in negative_taxa
+        def negative_screen(levels):
+            return not negative_taxa.isdisjoint(levels)
 
     # The positive_taxa and negative_taxa lists must be mutually exclusive.
     if len(positive_taxa & negative_taxa) != 0:
@@ -81,21 +84,10 @@ def get_otu_ids_from_taxonomy_f(positive_taxa=None,
 
     # Define the function that can be passed to Table.filter_observations
     def result(v, oid, md):
-        positive_hit = False
-        negative_hit = False
-        for e in md[metadata_field]:
-            if positive_screen(e.strip().lower()):
-                # Note that we don't want to just do
-                # positive_hit = positive_screen(e.strip())
-                # we're checking whether any e hits the positive taxa
-                # and doing that be the same as
-                # positive_hit = md[metadata_field][-1]
-                positive_hit = True
-            if negative_screen(e.strip().lower()):
-                # see note in previous if statement for why we don't use
-                # negative_hit = negative_screen(e.strip())
-                negative_hit = True
-        return positive_hit and not negative_hit
+        # we're checking whether any level hits the positive (or negative)
+        # taxa, not just the last level
+        levels = [e.strip().lower() for e in md[metadata_field]]
+        return positive_screen(levels) and not negative_screen(levels)
 
     return result
 
@@ -18,8 +18,11 @@ import os
 from os.path import expandvars
 import re
 from types import GeneratorType
+from itertools import islice
+from operator import itemgetter
 
-from numpy import concatenate, repeat, zeros, nan, asarray
+from numpy import (concatenate, repeat, zeros, empty, nan, array, asarray,
+                   fromstring, float64, arange, searchsorted)
 from numpy.random import permutation
 
 from skbio.stats.ordination import OrdinationResults
@@ -93,21 +96,6 @@ def parse_mapping_file(lines, strip_quotes=True, suppress_stripping=False):
             raise QiimeParseError("A string was passed that doesn't refer "
                                   "to an accessible filepath.")
 
-    if strip_quotes:
-        if suppress_stripping:
-            # remove quotes but not spaces
-            strip_f = lambda x: x.replace('"', '')
-        else:
-            # remove quotes and spaces
-            strip_f = lambda x: x.replace('"', '').strip()
-    else:
-        if suppress_stripping:
-            # don't remove quotes or spaces
-            strip_f = lambda x: x
-        else:
-            # remove spaces but not quotes
-            strip_f = lambda x: x.strip()
-
     # Create lists to store the results
     mapping_data = []
     header = []
@@ -115,7 +103,12 @@ def parse_mapping_file(lines, strip_quotes=True, suppress_stripping=False):
 
     # Begin iterating over lines
     for line in lines:
-        line = strip_f(line)
+        # remove quotes and/or surrounding spaces (done inline to avoid a
+        # function call per line)
+        if strip_quotes:
+            line = line.replace('"', '')
+        if not suppress_stripping:
+            line = line.strip()
         if not line or (suppress_stripping and not line.strip()):
             # skip blank lines when not stripping lines
             continue
@@ -127,8 +120,13 @@ def parse_mapping_file(lines, strip_quotes=True, suppress_stripping=False):
             else:
                 comments.append(line)
         else:
-            # Will add empty string to empty fields
-            tmp_line = map(strip_f, line.split('\t'))
+            # Will add empty string to empty fields. Quotes have already been
+            # removed from the whole line, so the fields only need to have
+            # surrounding spaces stripped
+            if suppress_stripping:
+                tmp_line = line.split('\t')
+            else:
+                tmp_line = [field.strip() for field in line.split('\t')]
             if len(tmp_line) < len(header):
                 tmp_line.extend([''] * (len(header) - len(tmp_line)))
             mapping_data.append(tmp_line)
@@ -195,9 +193,8 @@ def group_by_field(table, name):
         raise ValueError("Couldn't find name %s in headers: %s" %
                          (name, table[0]))
     result = defaultdict(list)
-    for row in table[1:]:
-        header, state = row[0], row[col_index]
-        result[state].append(header)
+    for row in islice(table, 1, None):
+        result[row[col_index]].append(row[0])
     return result
 
 
@@ -208,34 +205,93 @@ def group_by_fields(table, names):
     """
     col_indices = map(table[0].index, names)
     result = defaultdict(list)
-    for row in table[1:]:
-        header = row[0]
-        states = tuple([row[i] for i in col_indices])
-        result[states].append(header)
+    if len(col_indices) > 1:
+        # itemgetter builds the tuple of states in a single C call (for a
+        # single index it would return the state itself, not a tuple)
+        get_states = itemgetter(*col_indices)
+        for row in islice(table, 1, None):
+            result[get_states(row)].append(row[0])
+    else:
+        for row in islice(table, 1, None):
+            result[tuple([row[i] for i in col_indices])].append(row[0])
     return result
 
 
+def _parse_float_fields(fields, delim='\t'):
+    """Returns a float64 array from a string of delim-separated values.
+
+    The conversion is done by numpy's C tokenizer, so no intermediate list
+    of python floats is built. fromstring silently stops at the first value
+    it can't convert and treats any run of whitespace as a separator, so its
+    result is only used when every field is a single non-empty token and
+    all fields were converted. Other strings are converted field by field,
+    which raises a ValueError on a bad value as float() would.
+    """
+    if not fields:
+        return zeros(0, dtype=float64)
+    num_fields = fields.count(delim) + 1
+    tokens = fields.split()
+    if len(tokens) == num_fields and delim.join(tokens) == fields.strip():
+        result = fromstring(fields, dtype=float64, sep=delim)
+        # a numeric prefix of the last field (e.g. '2x') is read as a value,
+        # so that field is checked separately
+        if result.size == num_fields:
+            float(fields.rpartition(delim)[2])
+            return result
+    return array(fields.split(delim), dtype=float64)
+
+
+def _to_pylist(a):
+    """Returns a list of python objects from an array or other iterable
+
+    ndarray.tolist unboxes all of the values in a single call, where
+    iterating over an array creates one numpy scalar per value. Code that
+    builds dicts from numpy values should go through this function.
+    """
+    if hasattr(a, 'tolist'):
+        return a.tolist()
+    return list(a)
+
+
 def parse_distmat(lines):
     """Parser for distance matrix file (e.g. UniFrac dist matrix).
 
     The examples I have of this file are just sample x sample tab-delimited
     text, so easiest way to handle is just to convert into a numpy array
     plus a list of field names.
+
+    lines can be a list of lines, an open file, or a filepath.
     """
+    if hasattr(lines, 'upper'):
+        # Try opening if a string was passed
+        try:
+            lines = open(lines, 'U')
+        except IOError:
+            raise QiimeParseError("A string was passed that doesn't refer "
+                                  "to an accessible filepath.")
     header = None
     result = []
     for line in lines:
         if line[0] == '\t':  # is header
-            header = map(strip, line.split('\t')[1:])
+            header = [field.strip() for field in line.split('\t')[1:]]
         else:
-            result.append(map(float, line.split('\t')[1:]))
+            result.append(_parse_float_fields(line.partition('\t')[2]))
     return header, asarray(result)
 
 
 def parse_matrix(lines):
     """Parser for a matrix file Tab delimited. skips first lines if led
     by '#', assumes column headers line starts with a tab
+
+    lines can be a list of lines, an open file, or a filepath.
     """
+    if hasattr(lines, 'upper'):
+        # Try opening if a string was passed
+        try:
+            lines = open(lines, 'U')
+        except IOError:
+            raise QiimeParseError("A string was passed that doesn't refer "
+                                  "to an accessible filepath.")
     col_headers = None
     result = []
     row_headers = []
@@ -243,11 +299,11 @@ def parse_matrix(lines):
         if line[0] == '#':
             continue
         if line[0] == '\t':  # is header
-            col_headers = map(strip, line.split('\t')[1:])
+            col_headers = [field.strip() for field in line.split('\t')[1:]]
         else:
-            entries = line.split('\t')
-            result.append(map(float, entries[1:]))
-            row_headers.append(entries[0])
+            row_header, _, fields = line.partition('\t')
+            result.append(_parse_float_fields(fields))
+            row_headers.append(row_header)
     return col_headers, row_headers, asarray(result)
 
 
@@ -260,11 +316,8 @@ def parse_distmat_to_dict(table):
     col_headers, row_headers, data = parse_matrix(table)
     assert(col_headers == row_headers)
 
-    result = defaultdict(dict)
-    for (sample_id_x, row) in zip(col_headers, data):
-        for (sample_id_y, value) in zip(row_headers, row):
-            result[sample_id_x][sample_id_y] = value
-    return result
+    return {sample_id_x: dict(zip(row_headers, _to_pylist(row)))
+            for sample_id_x, row in zip(col_headers, data)}
 
 
 def parse_bootstrap_support(lines):
@@ -293,18 +346,18 @@ def parse_rarefaction_data(lines):
             data['headers'].append(l.strip('#').strip())
             continue
         if l.startswith('xaxis'):
-            data['xaxis'] = [float(v) for v in l[6:].strip().split('\t')]
+            data['xaxis'] = _parse_float_fields(l[6:].strip()).tolist()
             continue
         if l.startswith('>>'):
             data['options'].append(l.strip('>').strip())
             continue
         if l.startswith('series'):
             data['series'][data['options'][len(data['options']) - 1]] = \
-                [float(v) for v in l[7:].strip().split('\t')]
+                _parse_float_fields(l[7:].strip()).tolist()
             continue
         if l.startswith('error'):
             data['error'][data['options'][len(data['options']) - 1]] = \
-                [float(v) for v in l[6:].strip().split('\t')]
+                _parse_float_fields(l[6:].strip()).tolist()
         if l.startswith('color'):
             data['color'][data['options'][len(data['options']) - 1]] = \
                 str(l[6:].strip())
@@ -322,8 +375,14 @@ def parse_rarefaction_record(line):
         except ValueError:
             return nan
 
-    entries = line.split('\t')
-    return entries[0], map(float_or_nan, entries[1:])
+    rarefaction_fn, _, fields = line.partition('\t')
+    try:
+        # records are usually all numeric, so try converting them with a
+        # single call before falling back to converting one value at a time
+        data = _parse_float_fields(fields).tolist()
+    except ValueError:
+        data = map(float_or_nan, fields.split('\t'))
+    return rarefaction_fn, data
 
 
 def parse_rarefaction(lines):
@@ -339,7 +398,7 @@ def parse_rarefaction(lines):
             comments.append(line)
         elif line[0] == '\t':
             # is header
-            col_headers = map(strip, line.split('\t'))
+            col_headers = [field.strip() for field in line.split('\t')]
         else:
             # is rarefaction record
             rarefaction_fn, data = parse_rarefaction_record(line)
@@ -408,9 +467,10 @@ def parse_taxonomy(infile):
     for line in infile:
         if not line or line.startswith('#'):
             continue
-        line = line.rstrip("\n")
-        fields = line.split('\t')
-        otu = fields[0].split(' ')[0]
+        # only the first two fields are used, so the rest of the line isn't
+        # split (taxa_split strips the trailing newline from the taxonomy)
+        fields = line.split('\t', 2)
+        otu = fields[0].partition(' ')[0]
         res[otu] = taxa_split(fields[1])
 
     return res
@@ -484,74 +544,99 @@ def parse_classic_otu_table(lines, count_map_f=int, remove_empty_rows=False):
 
     Returns tuple: sample_ids, otu_ids, matrix of OTUs(rows) x samples(cols),
     and lineages from infile.
+
+    lines can be a list of lines, an open file, or a filepath.
     """
-    otu_table = []
-    otu_ids = []
-    metadata = []
-    sample_ids = []
-    # iterate over lines in the OTU table -- keep track of line number
-    # to support legacy (Qiime 1.2.0 and earlier) OTU tables
+    if hasattr(lines, 'upper'):
+        # Try opening if a string was passed
+        try:
+            lines = open(lines, 'U')
+        except IOError:
+            raise QiimeParseError("A string was passed that doesn't refer "
+                                  "to an accessible filepath.")
+    lines = list(lines)
+
+    # find the sample IDs line -- keep track of line number to support
+    # legacy (Qiime 1.2.0 and earlier) OTU tables
     for i, line in enumerate(lines):
         line = line.strip()
-        if line:
-            if (i == 1 or i == 0) and line.startswith('#OTU ID') and not sample_ids:
-                # we've got a legacy OTU table
-                try:
-                    sample_ids, has_metadata = process_otu_table_sample_ids(
-                        line.strip().split('\t')[1:])
-                except ValueError:
-                    raise ValueError("Error parsing sample IDs in OTU table. Appears to be a" +
-                                     " legacy OTU table. Sample ID line:\n %s" % line)
-            elif not line.startswith('#'):
-                if not sample_ids:
-                    # current line is the first non-space, non-comment line
-                    # in OTU table, so contains the sample IDs
-                    try:
-                        sample_ids, has_metadata = process_otu_table_sample_ids(
-                            line.strip().split('\t')[1:])
-                    except ValueError:
-                        raise ValueError("Error parsing sample IDs in OTU table." +
-                                         " Sample ID line:\n %s" % line)
-                else:
-                    # current line is OTU line in OTU table
-                    fields = line.split('\t')
-
-                    if has_metadata:
-                        # if there is OTU metadata the last column gets appended
-                        # to the metadata list
-                        # added in a try/except to handle OTU tables containing
-                        # floating numbers
-                        try:
-                            valid_fields = asarray(
-                                fields[1:-1],
-                                dtype=count_map_f)
-                        except ValueError:
-                            valid_fields = asarray(fields[1:-1], dtype=float)
-                        # validate that there are no empty rows
-                        if remove_empty_rows and (valid_fields >= 0).all() and \
-                           sum(valid_fields) == 0.0:
-                            continue
-                        metadata.append(map(strip, fields[-1].split(';')))
-                    else:
-                        # otherwise all columns are appended to otu_table
-                        # added in a try/except to handle OTU tables containing
-                        # floating numbers
-                        try:
-                            valid_fields = asarray(
-                                fields[1:],
-                                dtype=count_map_f)
-                        except ValueError:
-                            valid_fields = asarray(fields[1:], dtype=float)
-                        # validate that there are no empty rows
-                        if remove_empty_rows and (valid_fields >= 0.0).all() and \
-                           sum(valid_fields) == 0.0:
-                            continue
-                    otu_table.append(valid_fields)
-                    # grab the OTU ID
-                    otu_id = fields[0].strip()
-                    otu_ids.append(otu_id)
-
-    return sample_ids, otu_ids, asarray(otu_table), metadata
+        if not line:
+            continue
+        if (i == 1 or i == 0) and line.startswith('#OTU ID'):
+            # we've got a legacy OTU table
+            try:
+                sample_ids, has_metadata = process_otu_table_sample_ids(
+                    line.split('\t')[1:])
+            except ValueError:
+                raise ValueError("Error parsing sample IDs in OTU table. Appears to be a" +
+                                 " legacy OTU table. Sample ID line:\n %s" % line)
+            break
+        elif not line.startswith('#'):
+            # current line is the first non-space, non-comment line
+            # in OTU table, so contains the sample IDs
+            try:
+                sample_ids, has_metadata = process_otu_table_sample_ids(
+                    line.split('\t')[1:])
+            except ValueError:
+                raise ValueError("Error parsing sample IDs in OTU table." +
+                                 " Sample ID line:\n %s" % line)
+            break
+    else:
+        # no sample IDs line, so there are no OTUs either
+        return [], [], asarray([]), []
+
+    # the number of remaining lines is an upper bound on the number of
+    # OTUs, so the results are preallocated and trimmed at the end
+    num_lines = len(lines) - i - 1
+    otu_table = empty((num_lines, len(sample_ids)), dtype=count_map_f)
+    otu_ids = [None] * num_lines
+    metadata = [None] * num_lines if has_metadata else []
+    # if there is OTU metadata it is the last column, otherwise all columns
+    # after the OTU ID are counts
+    counts_end = -1 if has_metadata else None
+    otu_count = 0
+    for line in islice(lines, i + 1, None):
+        stripped_line = line.strip()
+        if not stripped_line or stripped_line.startswith('#'):
+            continue
+        # current line is OTU line in OTU table -- only the line ending is
+        # removed, since stripping would drop the tab before an empty lineage
+        fields = line.rstrip('\r\n').split('\t')
+        counts = fields[1:counts_end]
+        # a single count would otherwise be broadcast across the whole row
+        if len(counts) != len(sample_ids):
+            raise ValueError("Error parsing OTU table: expected %d counts "
+                             "but found %d in OTU line: %r" %
+                             (len(sample_ids), len(counts), line))
+        # added in a try/except to handle OTU tables containing floating
+        # numbers: the whole table is cast to float
+        try:
+            otu_table[otu_count] = counts
+        except ValueError:
+            otu_table = otu_table.astype(float)
+            otu_table[otu_count] = counts
+        # validate that there are no empty rows -- the row is overwritten by
+        # the next OTU if it is discarded
+        valid_fields = otu_table[otu_count]
+        if remove_empty_rows and (valid_fields >= 0).all() and \
+           valid_fields.sum() == 0.0:
+            continue
+        if has_metadata:
+            metadata[otu_count] = taxa_split(fields[-1])
+        # grab the OTU ID
+        otu_ids[otu_count] = fields[0].strip()
+        otu_count += 1
+
+    del otu_ids[otu_count:]
+    del metadata[otu_count:]
+    # a table without OTUs has always been returned as an empty 1-d array
+    if not otu_count:
+        return sample_ids, otu_ids, asarray([]), metadata
+    # a view of the first rows would keep the whole buffer alive when many
+    # lines were comments, blank or dropped as empty rows
+    if otu_count < num_lines:
+        otu_table = otu_table[:otu_count].copy()
+    return sample_ids, otu_ids, otu_table, metadata
 parse_otu_table = parse_classic_otu_table
 
 
@@ -574,11 +659,17 @@ def make_envs_dict(abund_mtx, sample_names, taxon_names):
             (abund_mtx.shape, num_samples, num_seqs))
     envs_dict = {}
     sample_names = asarray(sample_names)
-    for i, taxon in enumerate(abund_mtx.T):
-
-        nonzeros = taxon.nonzero()  # this removes zero values to reduce memory
-        envs_dict[taxon_names[i]] = dict(zip(sample_names[nonzeros],
-                                             taxon[nonzeros]))
+    # a single scan of the transposed matrix finds the nonzero values (this
+    # removes zero values to reduce memory), already grouped by taxon
+    taxon_idxs, sample_idxs = abund_mtx.T.nonzero()
+    abundances = _to_pylist(abund_mtx.T[taxon_idxs, sample_idxs])
+    nonzero_sample_names = _to_pylist(sample_names[sample_idxs])
+    # the values for the ith taxon are in bounds[i]:bounds[i + 1]
+    bounds = searchsorted(taxon_idxs, arange(num_seqs + 1))
+    for i, taxon_name in enumerate(taxon_names):
+        start, end = bounds[i], bounds[i + 1]
+        envs_dict[taxon_name] = dict(zip(nonzero_sample_names[start:end],
+                                         abundances[start:end]))
     return envs_dict
 
 
@@ -587,7 +678,11 @@ def fields_to_dict(lines, delim='\t', strip_f=strip):
     result = {}
     for line in lines:
         # skip empty lines
-        if strip_f:
+        if strip_f is strip:
+            # calling the method directly avoids a python-level call to
+            # string.strip for every field
+            fields = [field.strip() for field in line.split(delim)]
+        elif strip_f:
             fields = map(strip_f, line.split(delim))
         else:
             fields = line.split(delim)
@@ -603,6 +698,9 @@ def parse_qiime_parameters(lines):
     # The result object is a default dict: if keys are not
     # present, {} is returned
     result = defaultdict(dict)
+    # script_id:parameter_id, optionally followed by whitespace and a value
+    # (which may itself contain whitespace)
+    parameter_mask = re.compile('^([^:\s]+):([^:\s]+)(?:\s+(.*))?$')
 
     for line in lines:
         line = line.strip()
@@ -614,19 +712,20 @@ def parse_qiime_parameters(lines):
             if pound_pos > 0 and line[pound_pos - 1].isspace():
                 line = line[:pound_pos].rstrip()
 
-            fields = line.split(None, 1)
-            script_id, parameter_id = fields[0].split(':')
-            try:
-                value = fields[1]
-            except IndexError:
+            match = parameter_mask.match(line)
+            if match is None:
+                raise ValueError("Invalid line in parameters file (expected "
+                                 "script_id:parameter_id followed by an "
+                                 "optional value): %s" % line)
+            script_id, parameter_id, value = match.groups()
+            if value is None:
                 continue
 
-            if value.upper() == 'FALSE' or value.upper() == 'NONE':
+            upper_value = value.upper()
+            if upper_value == 'FALSE' or upper_value == 'NONE':
                 continue
-            elif value.upper() == 'TRUE':
+            elif upper_value == 'TRUE':
                 value = None
-            else:
-                pass
 
             result[script_id][parameter_id] = value
     return result
@@ -634,6 +733,24 @@ def parse_qiime_parameters(lines):
 
 def parse_qiime_config_file(qiime_config_file):
     """ Parse lines in a qiime_config file
+
+        qiime_config_file can be a list of lines, an open file, or the path
+         to a qiime_config file. When a path is passed, the file is only
+         parsed again if it has been modified since the last time it was
+         parsed by this process.
+    """
+    if hasattr(qiime_config_file, 'upper'):
+        raw_values = _get_qiime_config_raw_values(qiime_config_file)
+    else:
+        raw_values = _parse_qiime_config_raw_values(qiime_config_file)
+    # environment variables are expanded on every call so that cached
+    # values reflect the current environment
+    return dict([(param_id, expandvars(param_value) or None)
+                 for param_id, param_value in raw_values.items()])
+
+
+def _parse_qiime_config_raw_values(qiime_config_file):
+    """ Return dict of param_id:unexpanded value from qiime_config lines
     """
     result = {}
     for line in qiime_config_file:
@@ -643,17 +760,48 @@ def parse_qiime_config_file(qiime_config_file):
             continue
         fields = line.split()
         param_id = fields[0]
-        param_value = expandvars(' '.join(fields[1:])) or None
+        param_value = ' '.join(fields[1:])
         result[param_id] = param_value
     return result
 
 
+# maps absolute qiime_config filepaths to ((mtime, size), raw values)
+_qiime_config_cache = {}
+
+
+def _get_qiime_config_raw_values(qiime_config_fp):
+    """ Return raw values from qiime_config_fp, parsing it only if needed
+
+        The file is parsed again if its modification time or size changed,
+         since an edit within the mtime resolution of the filesystem
+         leaves the mtime unchanged. Raises an IOError if qiime_config_fp
+         can't be read.
+    """
+    qiime_config_fp = os.path.abspath(qiime_config_fp)
+    try:
+        st = os.stat(qiime_config_fp)
+    except OSError as e:
+        raise IOError(str(e))
+    file_state = (st.st_mtime, st.st_size)
+    try:
+        cached_state, raw_values = _qiime_config_cache[qiime_config_fp]
+    except KeyError:
+        cached_state = None
+    if cached_state != file_state:
+        with open(qiime_config_fp, 'U') as qiime_config_f:
+            raw_values = _parse_qiime_config_raw_values(qiime_config_f)
+        _qiime_config_cache[qiime_config_fp] = (file_state, raw_values)
+    return raw_values
+
+
 def parse_qiime_config_files(qiime_config_files):
     """ Parse files in (ordered!) list of qiime_config_files
 
         The order of files must be least important to most important.
          Values defined in earlier files will be overwritten if the same
-         values are defined in later files.
+         values are defined in later files. Each entry can be anything
+         accepted by parse_qiime_config_file; files that can't be read are
+         skipped.
     """
     # The qiime_config object is a default dict: if keys are not
     # present, none is returned
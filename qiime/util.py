@@ -331,12 +331,13 @@ def load_qiime_config():
         qiime_config_home_filepath = home_dir + '/.qiime_config'
         qiime_config_filepaths.append(qiime_config_home_filepath)
 
-    qiime_config_files = []
-    for qiime_config_filepath in qiime_config_filepaths:
-        if exists(qiime_config_filepath):
-            qiime_config_files.append(open(qiime_config_filepath))
+    qiime_config_filepaths = [qiime_config_filepath
+                              for qiime_config_filepath in qiime_config_filepaths
+                              if exists(qiime_config_filepath)]
 
-    qiime_config = parse_qiime_config_files(qiime_config_files)
+    # filepaths rather than open files are passed so that the parsed
+    # files can be cached
+    qiime_config = parse_qiime_config_files(qiime_config_filepaths)
 
     # For files that are defined in the qiime-default-reference package,
     # add values to the qiime_config if they haven't already been defined.
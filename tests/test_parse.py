@@ -12,8 +12,10 @@ __version__ = "1.9.1-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
-from os import close
-from tempfile import mkstemp
+from os import close, utime, getcwd, chdir
+from os.path import getmtime, join
+from shutil import rmtree
+from tempfile import mkstemp, mkdtemp
 
 from numpy import array, nan
 from StringIO import StringIO
@@ -34,7 +36,7 @@ from qiime.parse import (group_by_field, group_by_fields,
                          mapping_file_to_dict, MinimalQualParser, parse_denoiser_mapping,
                          parse_otu_map, parse_sample_id_map, parse_taxonomy_to_otu_metadata,
                          is_casava_v180_or_later, MinimalSamParser,
-                         parse_items)
+                         parse_items, _parse_float_fields, _to_pylist)
 
 
 class TopLevelTests(TestCase):
@@ -170,6 +172,24 @@ class TopLevelTests(TestCase):
         obs = parse_mapping_file(s2)
         self.assertEqual(obs, exp)
 
+    def test_parse_mapping_file_stripping_options(self):
+        """parse_mapping_file honors strip_quotes and suppress_stripping"""
+        s1 = ['#sample\ta\tb', '"x "\t y \t"z"', ' ', 'i\tj\tk']
+        header = ['sample', 'a', 'b']
+
+        obs = parse_mapping_file(s1, strip_quotes=False)
+        self.assertEqual(obs, ([['"x "', 'y', '"z"'], ['i', 'j', 'k']],
+                               header, []))
+
+        obs = parse_mapping_file(s1, suppress_stripping=True)
+        self.assertEqual(obs, ([['x ', ' y ', 'z'], ['i', 'j', 'k']],
+                               header, []))
+
+        obs = parse_mapping_file(s1, strip_quotes=False,
+                                 suppress_stripping=True)
+        self.assertEqual(obs, ([['"x "', ' y ', '"z"'], ['i', 'j', 'k']],
+                               header, []))
+
     def test_mapping_file_to_dict(self):
         """parse_mapping_file functions as expected"""
         s1 = ['#sample\ta\tb', '#comment line to skip',
@@ -305,6 +325,9 @@ class TopLevelTests(TestCase):
         self.assertEqual(group_by_fields(t, ['age', 'loc']),
                          {('5', 'US'): ['a'], ('10', 'US'): ['b'], ('5', 'Mal'): ['c', 'e'],
                           ('10', 'Mal'): ['d']})
+        # states are always tuples, even for a single field
+        self.assertEqual(group_by_fields(t, ['mal']),
+                         {('n',): ['a', 'b', 'd'], ('y',): ['c', 'e']})
 
     def test_parse_distmat(self):
         """parse_distmat should read distmat correctly"""
@@ -318,6 +341,56 @@ c\t1\t3.5\t0
         self.assertEqual(obs[0], exp[0])
         assert_almost_equal(obs[1], exp[1])
 
+    def test_parse_distmat_handles_filepath(self):
+        """parse_distmat should read distmat from a filepath"""
+        fd, fp = mkstemp(prefix='test_parse_distmat', suffix='.txt')
+        close(fd)
+        self.files_to_remove.append(fp)
+        open(fp, 'w').write('\ta\tb\na\t0\t1.5\nb\t1.5\t0\n')
+        obs = parse_distmat(fp)
+        self.assertEqual(obs[0], ['a', 'b'])
+        assert_almost_equal(obs[1], array([[0, 1.5], [1.5, 0]]))
+        self.assertRaises(QiimeParseError, parse_distmat, fp + '.missing')
+
+    def test_parse_distmat_invalid_values(self):
+        """parse_distmat should raise ValueError on non-numeric values"""
+        lines = """\ta\tb
+a\t0\t1
+b\tx\t0
+""".splitlines()
+        self.assertRaises(ValueError, parse_distmat, lines)
+        self.assertRaises(ValueError, parse_distmat,
+                          ['\ta\tb', 'a\t0\t1.5x', 'b\t1.5\t0'])
+        self.assertRaises(ValueError, parse_distmat,
+                          ['\ta\tb\tc', 'a\t0 1\t\t2'])
+
+    def test_parse_float_fields(self):
+        """_parse_float_fields converts delimited values to a float array"""
+        assert_almost_equal(_parse_float_fields('0\t1.5\t-2\n'),
+                            array([0.0, 1.5, -2.0]))
+        assert_almost_equal(_parse_float_fields('0,1.5', delim=','),
+                            array([0.0, 1.5]))
+        self.assertEqual(_parse_float_fields('').size, 0)
+
+        # bad or missing values raise a ValueError
+        self.assertRaises(ValueError, _parse_float_fields, '0\tNA')
+        self.assertRaises(ValueError, _parse_float_fields, '0\t\t1')
+        self.assertRaises(ValueError, _parse_float_fields, '0\t')
+        self.assertRaises(ValueError, _parse_float_fields, '0\t1x')
+        self.assertRaises(ValueError, _parse_float_fields, '0x\t1')
+        # spaces inside a field must not be read as separators
+        self.assertRaises(ValueError, _parse_float_fields, '1 2 3\tx\t4')
+        self.assertRaises(ValueError, _parse_float_fields, '0 1\t\t2')
+
+    def test_to_pylist(self):
+        """_to_pylist returns python objects from arrays and iterables"""
+        obs = _to_pylist(array([1.5, 2.0]))
+        self.assertEqual(obs, [1.5, 2.0])
+        self.assertEqual(type(obs[0]), float)
+        self.assertEqual(_to_pylist(array(['a', 'b'])), ['a', 'b'])
+        self.assertEqual(_to_pylist((1, 2)), [1, 2])
+        self.assertEqual(_to_pylist(x for x in 'ab'), ['a', 'b'])
+
     def test_parse_distmat_to_dict(self):
         """parse_distmat should return dict of distmat"""
         lines = """\ta\tb\tc
@@ -408,6 +481,12 @@ node2\t0
                                                 0.42876999999999998, nan])
         self.assertEqual(self.rarefactiondata2, test2)
 
+        # missing values written by collate_alpha.py
+        test3 = parse_rarefaction_record('rare10.txt\tn/a\tn/a\t1.5\n')
+        self.assertEqual(test3, ('rare10.txt', [nan, nan, 1.5]))
+        test4 = parse_rarefaction_record('rare10.txt\t1\t2e')
+        self.assertEqual(test4, ('rare10.txt', [1.0, nan]))
+
     def test_parse_rarefaction_fname(self):
         """ parse_rarefaction_fname should return base, seqs/sam, iters, etc."""
         fname = "alpha_rarefaction_900_3.txt"
@@ -753,6 +832,92 @@ node2\t0
         assert_almost_equal(obs[2], exp[2])
         self.assertEqual(obs[3], exp[3])
 
+    def test_parse_classic_otu_table_handles_filepath(self):
+        """parse_classic_otu_table should read a table from a filepath"""
+        fd, fp = mkstemp(prefix='test_parse_classic_otu_table',
+                         suffix='.txt')
+        close(fd)
+        self.files_to_remove.append(fp)
+        open(fp, 'w').write(self.otu_table1)
+        obs = parse_classic_otu_table(fp)
+        self.assertEqual(obs[0], ['Fing', 'Key', 'NA'])
+        self.assertEqual(obs[1], ['0', '1', '2', '3', '4'])
+        assert_almost_equal(obs[2], array([[19111, 44536, 42], [1216, 3500, 6],
+                                           [1803, 1184, 2], [1722, 4903, 17],
+                                           [589, 2074, 34]]))
+        self.assertEqual(obs[3], self.expected_lineages1)
+        self.assertRaises(QiimeParseError, parse_classic_otu_table,
+                          fp + '.missing')
+
+    def test_parse_classic_otu_table_remove_empty_rows(self):
+        """parse_classic_otu_table should drop empty rows when requested"""
+        data = """#Full OTU Counts
+#OTU ID	Fing	Key	NA	Consensus Lineage
+0	19111	44536	42	Bacteria; Actinobacteria
+1	0	0	0	Bacteria; Firmicutes
+2	1803	1184	2	Bacteria; Cyanobacteria"""
+        obs = parse_classic_otu_table(data.split('\n'), remove_empty_rows=True)
+        self.assertEqual(obs[0], ['Fing', 'Key', 'NA'])
+        self.assertEqual(obs[1], ['0', '2'])
+        assert_almost_equal(obs[2], array([[19111, 44536, 42],
+                                           [1803, 1184, 2]]))
+        self.assertEqual(obs[3], [['Bacteria', 'Actinobacteria'],
+                                  ['Bacteria', 'Cyanobacteria']])
+
+        # the table doesn't hold on to the rows that were dropped
+        self.assertTrue(obs[2].base is None)
+
+        # all rows are kept by default
+        obs = parse_classic_otu_table(data.split('\n'))
+        self.assertEqual(obs[1], ['0', '1', '2'])
+        assert_almost_equal(obs[2], array([[19111, 44536, 42], [0, 0, 0],
+                                           [1803, 1184, 2]]))
+
+    def test_parse_classic_otu_table_no_otus(self):
+        """parse_classic_otu_table should return an empty table without OTUs"""
+        # no sample ID line
+        obs = parse_classic_otu_table([])
+        self.assertEqual(obs[0], [])
+        self.assertEqual(obs[1], [])
+        self.assertEqual(obs[2].shape, (0,))
+        self.assertEqual(obs[3], [])
+        obs = parse_classic_otu_table(['#Full OTU Counts', ''])
+        self.assertEqual(obs[2].shape, (0,))
+
+        # header only
+        obs = parse_classic_otu_table(
+            ['#Full OTU Counts', '#OTU ID\ta\tb\tConsensus Lineage'])
+        self.assertEqual(obs[0], ['a', 'b'])
+        self.assertEqual(obs[1], [])
+        self.assertEqual(obs[2].shape, (0,))
+        self.assertEqual(obs[3], [])
+
+        # all rows removed as empty
+        obs = parse_classic_otu_table(['#OTU ID\ta\tb', 'o1\t0\t0'],
+                                      remove_empty_rows=True)
+        self.assertEqual(obs[1], [])
+        self.assertEqual(obs[2].shape, (0,))
+
+    def test_parse_classic_otu_table_wrong_number_of_counts(self):
+        """parse_classic_otu_table should reject rows of the wrong length"""
+        # a single count must not be broadcast across all samples
+        lines = ['#OTU ID\ta\tb\tc', 'o1\t5', 'o2\t1\t2\t3']
+        self.assertRaises(ValueError, parse_classic_otu_table, lines)
+        lines = ['#OTU ID\ta\tb', 'o1\t1\t2\t3']
+        self.assertRaises(ValueError, parse_classic_otu_table, lines)
+        lines = ['#OTU ID\ta\tb\tConsensus Lineage', 'o1\t1\t2\t3\tB']
+        self.assertRaises(ValueError, parse_classic_otu_table, lines)
+
+    def test_parse_classic_otu_table_empty_lineage(self):
+        """parse_classic_otu_table should keep an empty trailing lineage"""
+        lines = ['#OTU ID\ta\tb\tConsensus Lineage', 'o1\t1\t2\t\n',
+                 'o2\t3\t4\tBacteria\n']
+        obs = parse_classic_otu_table(lines)
+        self.assertEqual(obs[0], ['a', 'b'])
+        self.assertEqual(obs[1], ['o1', 'o2'])
+        assert_almost_equal(obs[2], array([[1, 2], [3, 4]]))
+        self.assertEqual(obs[3], [[''], ['Bacteria']])
+
     def test_make_envs_dict(self):
         """ make_envs_dict should have the same abundance for each taxon
         as the matrix that made the dict"""
@@ -763,6 +928,16 @@ node2\t0
             self.assertEqual(sum(envs[key].values()),
                              self.l19_data[:, col_idx].sum())
 
+    def test_make_envs_dict_empty_taxa(self):
+        """ make_envs_dict should keep taxa with no counts as empty dicts"""
+        abund_mtx = array([[0, 3, 0], [1, 0, 0]])
+        envs = make_envs_dict(abund_mtx, ['s1', 's2'], ['t1', 't2', 't3'])
+        self.assertEqual(envs, {'t1': {'s2': 1}, 't2': {'s1': 3}, 't3': {}})
+
+        # shape mismatch
+        self.assertRaises(ValueError, make_envs_dict, abund_mtx, ['s1'],
+                          ['t1', 't2', 't3'])
+
     def test_fields_to_dict(self):
         """fields_to_dict should make first field key, rest val"""
         test_data = \
@@ -804,6 +979,13 @@ node2\t0
         # returns empty dict
         self.assertEqual(actual['some_other_script'], {})
 
+    def test_parse_qiime_parameters_invalid_input(self):
+        """parse_qiime_parameters: raises error on malformed lines """
+        self.assertRaises(ValueError, parse_qiime_parameters,
+                          ['similarity 0.94'])
+        self.assertRaises(ValueError, parse_qiime_parameters,
+                          ['pick_otus:similarity:x 0.94'])
+
     def test_parse_taxonomy(self):
         """ should parse taxonomy example, keeping otu id only"""
         example_tax = \
@@ -948,6 +1130,58 @@ node2\t0
         self.assertTrue('$' not in actual['key2'])
         self.assertTrue('$' not in actual['key3'])
 
+    def test_parse_qiime_config_files_filepaths(self):
+        """ parse_qiime_config_files handles filepaths """
+        fd, fp = mkstemp(prefix='test_parse_qiime_config_files',
+                         suffix='.txt')
+        close(fd)
+        self.files_to_remove.append(fp)
+        open(fp, 'w').write('key1\tval1\nkey2 val2\nkey3\t$HOME\n')
+
+        actual = parse_qiime_config_files([fp, ['key2\tval3']])
+        self.assertEqual(actual['key1'], 'val1')
+        self.assertEqual(actual['key2'], 'val3')
+        self.assertTrue('$' not in actual['key3'])
+
+        # unreadable files are skipped
+        actual = parse_qiime_config_files([fp, fp + '.does_not_exist'])
+        self.assertEqual(actual['key2'], 'val2')
+
+        # a modified file is parsed again
+        open(fp, 'w').write('key1\tval4\n')
+        mtime = getmtime(fp) + 10
+        utime(fp, (mtime, mtime))
+        actual = parse_qiime_config_files([fp])
+        self.assertEqual(actual, {'key1': 'val4'})
+
+        # an edit that leaves the mtime unchanged is caught by the size
+        utime(fp, (1000000000, 1000000000))
+        self.assertEqual(parse_qiime_config_files([fp]), {'key1': 'val4'})
+        open(fp, 'w').write('key1\tval55\n')
+        utime(fp, (1000000000, 1000000000))
+        actual = parse_qiime_config_files([fp])
+        self.assertEqual(actual, {'key1': 'val55'})
+
+    def test_parse_qiime_config_files_relative_filepaths(self):
+        """ parse_qiime_config_files resolves relative filepaths """
+        cwd = getcwd()
+        dirs = [mkdtemp(prefix='test_parse_qiime_config_files'),
+                mkdtemp(prefix='test_parse_qiime_config_files')]
+        try:
+            for i, d in enumerate(dirs):
+                fp = join(d, 'qiime_config')
+                open(fp, 'w').write('key1\tval%d\n' % i)
+                # same mtime and size, so only the path tells them apart
+                utime(fp, (1000000000, 1000000000))
+            for i, d in enumerate(dirs):
+                chdir(d)
+                actual = parse_qiime_config_files(['qiime_config'])
+                self.assertEqual(actual, {'key1': 'val%d' % i})
+        finally:
+            chdir(cwd)
+            for d in dirs:
+                rmtree(d)
+
     def test_parse_metadata_state_descriptions(self):
         """parse_metadata_state_descriptions should return correct states from string."""
         s = ''